@@ -1,113 +1,256 @@
 import os
-import requests
+import aiohttp
 import warnings
 import logging
 import json
+import orjson
 import asyncio
 import shutil
+import tempfile
+import threading
+import functools
+import numpy as np
 
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from glob import glob
-from collections import OrderedDict
+from io import BytesIO
+from itertools import chain
+from concurrent.futures import ThreadPoolExecutor
 
 # Disable imagededup's warnings and logging to keep output clean
 warnings.filterwarnings("ignore")
 logging.disable(logging.CRITICAL)
 
-# Paths for temporary downloads and cache
+# Load imagededup (and its model) once at import, before the server starts taking requests
+import torch
+from imagededup.methods import CNN, PHash
+from imagededup.utils.models import CustomModel, MobilenetV3
+from imagededup.utils.image_utils import load_image
+
+# CNN inference precision: "fp32", "fp16" (NVIDIA GPUs only), "bf16", or "auto" for fp16 on NVIDIA GPUs and fp32 otherwise
+cnn_precision = "auto"
+if cnn_precision not in ("auto", "fp32", "fp16", "bf16"):
+    # Fall back before the setting names the stored encodings file or the log line, so both match what runs
+    print(f"ℹ️ Unsupported cnn_precision {cnn_precision!r}, using fp32\n")
+    cnn_precision = "fp32"
+if cnn_precision == "auto" or (cnn_precision == "fp16" and not torch.cuda.is_available()):
+    cnn_precision = "fp16" if torch.cuda.is_available() else "fp32"
+cnn_precision_dtypes = {"fp16": torch.float16, "bf16": torch.bfloat16}
+
+# Number of images per CNN forward pass, lower it if the GPU runs out of memory
+cnn_batch_size = 64
+
+# Max CNN inputs prepared while downloading (about 600 KB each), the rest are decoded when their batch is encoded
+max_prepared_cnn_images = cnn_batch_size * 4
+
+# CNN inputs always have the same shape, so let cuDNN benchmark and pick the fastest convolution algorithms
+torch.backends.cudnn.benchmark = True
+
+# Path for the image cache
 script_path = os.path.dirname(os.path.abspath(__file__))
-temp_downloads_path = os.path.join(script_path, "temp_downloads")
 cache_path = os.path.join(script_path, "fdi_cache")
 
-# This will be set based on incoming data ("poster", "profile", "backdrop", or "logo")
-image_type = None
+# Sidecar file keeping a running total of the cached images' size, so startup doesn't need to walk the cache
+# (dot-files, i.e. this file, the stored encodings and temp files, aren't counted, by the sidecar or by the walk)
+cache_size_file_path = os.path.join(cache_path, ".size")
+cache_size_limit = 50 * 1024 * 1024
+
+# Encodings of cached images per detection method, so they don't have to be computed again on later runs
+encoding_file_paths = {"phash": os.path.join(cache_path, ".phash.json"), "cnn": os.path.join(cache_path, f".cnn_{cnn_precision}.npz")}
+
+# Mode for files written to the cache, matching what open() gives under the current umask (tempfile.mkstemp makes them owner-only)
+# os.umask can only be read by setting it, so it's restored right away
+_umask = os.umask(0)
+os.umask(_umask)
+cache_file_mode = 0o666 & ~_umask
+
+# Serializes read-modify-write updates of the files in the cache folder, requests run them from worker threads
+_cache_lock = threading.Lock()
+
+# Retry policy for transient CDN errors
+retry_statuses = (502, 503, 504)
+max_retries = 3
+retry_backoff_factor = 0.3
+
+# Duplicate detection encoders, built on first use and reused across requests
+_encoders = {}
+# Serializes building the encoders, so overlapping requests don't each build (and load onto the GPU) their own
+_encoders_lock = threading.Lock()
 
+# Max in-flight downloads per image type, small logos can afford more than large backdrops
+download_concurrency = {"logo": 48, "backdrop": 16}
+default_download_concurrency = 24
 
-def get_file_size(file_path):
+# Number of bits set in each byte value, for counting differing bits between hashes on NumPy < 2.0
+_popcount_table = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+# Rows of the hash distance matrix computed at once, keeps each block small enough to stay in CPU cache
+phash_block_size = 256
+
+# Threads that decode images as soon as they are downloaded, so decoding overlaps the remaining downloads
+# (Pillow and torch release the GIL while decoding and resizing, and threads avoid pickling images between processes)
+decode_pool = ThreadPoolExecutor(max_workers=os.cpu_count())
+
+# Downloads currently in flight keyed by (image_type, image_name), so overlapping requests download an image only once
+_inflight_downloads = {}
+
+# Shared HTTP session, created lazily on the server's event loop and reused across requests
+_session = None
+
+
+def get_session():
+    """
+    Return the shared aiohttp session, creating it on first use (or if it was closed).
+    Keeping one session alive lets connections to the image CDN be reused across requests.
     """
-    Return the size of a file in bytes, or 0 if it doesn't exist.
+    global _session
+    if _session is None or _session.closed:
+        connector = aiohttp.TCPConnector(limit=64, limit_per_host=32, keepalive_timeout=30)
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=5, sock_read=30)
+        _session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+    return _session
+
+
+async def close_session():
+    """
+    Close the shared aiohttp session if it is open.
+    """
+    global _session
+    if _session is not None and not _session.closed:
+        try:
+            await _session.close()
+        except Exception as e:
+            print(f"❌ Failed to close HTTP session: {e}")
+    _session = None
+
+
+def write_file_atomically(file_path, data):
+    """
+    Write bytes to file_path through a uniquely named temp file in the same folder, then rename it into place.
+    Concurrent writers never share a temp file, and a crash can't leave the file half written.
+    """
+    fd, tmp_file_path = tempfile.mkstemp(dir=os.path.dirname(file_path), prefix=".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.chmod(tmp_file_path, cache_file_mode)
+        os.replace(tmp_file_path, file_path)
+    except BaseException:
+        try:
+            os.unlink(tmp_file_path)
+        except OSError:
+            pass
+        raise
+
+
+def iter_file_sizes(folder):
+    """
+    Recursively yield the size of every file in a folder, skipping dot-files so it measures the same thing as the sidecar.
+    Uses os.scandir so each entry's stat result is fetched at most once.
     """
     try:
-        if os.path.exists(file_path):
-            return os.path.getsize(file_path)
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if entry.name.startswith("."):
+                    continue
+                # Only yield sizes of files, recurse into sub folders
+                if entry.is_file(follow_symlinks=False):
+                    yield entry.stat(follow_symlinks=False).st_size
+                elif entry.is_dir(follow_symlinks=False):
+                    yield from iter_file_sizes(entry.path)
+    except FileNotFoundError:
+        pass
     except Exception as e:
-        print(f"❌ Error getting size for {file_path}: {e}")
-    return 0
+        print(f"❌ Error computing folder size for {folder}: {e}")
 
 
 def get_folder_size(folder):
     """
     Recursively compute the total size of all files in a folder.
     """
+    return sum(iter_file_sizes(folder))
+
+
+def folder_size_exceeds(folder, limit):
+    """
+    Return True as soon as the total size of files in a folder goes over limit bytes,
+    without walking the rest of the folder.
+    """
     total_size = 0
-    try:
-        for dirpath, dirnames, filenames in os.walk(folder):
-            for f in filenames:
-                fp = os.path.join(dirpath, f)
-                # Only add size if it's a file
-                if os.path.isfile(fp):
-                    total_size += get_file_size(fp)
-    except Exception as e:
-        print(f"❌ Error computing folder size for {folder}: {e}")
-    return total_size
+    for size in iter_file_sizes(folder):
+        total_size += size
+        if total_size > limit:
+            return True
+    return False
 
 
-def move_downloads_to_cache_folder():
+def read_cache_size():
     """
-    Move all files from temp_downloads_path to cache_path, then remove temp_downloads_path.
+    Return the cache size recorded in the sidecar file, or None if it's missing or corrupt.
     """
-    # Ensure cache directory exists
     try:
-        os.makedirs(cache_path, exist_ok=True)
+        with open(cache_size_file_path, "r") as f:
+            size = json.load(f).get("size")
+        if isinstance(size, int) and size >= 0:
+            return size
+        print(f"ℹ️ Ignoring invalid cache size file {cache_size_file_path}")
+    except FileNotFoundError:
+        pass
     except Exception as e:
-        print(f"❌ Failed to create cache folder {cache_path}: {e}")
-        return
-
-    # If there is no temp download folder, skip
-    if not os.path.exists(temp_downloads_path):
-        print("ℹ️ Temp download folder doesn't exist, skipped moving to cache folder")
-        return
+        print(f"ℹ️ Ignoring unreadable cache size file {cache_size_file_path}: {e}")
+    return None
 
-    # Move each file from temp_downloads_path to cache_path
-    for src_file_path in glob(os.path.join(temp_downloads_path, "*")):
-        dst_file_path = os.path.join(cache_path, os.path.basename(src_file_path))
-        try:
-            shutil.move(src_file_path, dst_file_path)
-        except Exception as e:
-            print(f"❌ Failed to move image to cache folder {src_file_path}: {e}")
 
-    # Remove the temp download folder
+def write_cache_size(size):
+    """
+    Record the cache size in the sidecar file. Callers must hold _cache_lock.
+    """
     try:
-        shutil.rmtree(temp_downloads_path, ignore_errors=True)
+        write_file_atomically(cache_size_file_path, json.dumps({"size": size}).encode())
     except Exception as e:
-        print(f"❌ Failed to remove temp download folder {temp_downloads_path}: {e}")
+        print(f"❌ Failed to write cache size file {cache_size_file_path}: {e}")
 
 
-def download_image(image_name):
+def save_downloads_to_cache(downloads):
     """
-    Download a single image by name. If it's already cached, copy it instead of re-downloading.
-    Returns a tuple (success: bool, image_name: str).
+    Write freshly downloaded images (a mapping {image: bytes}) into cache_path and update the recorded cache size.
     """
-    # Ensure the temporary download directory exists
+    # Ensure cache directory exists
     try:
-        os.makedirs(temp_downloads_path, exist_ok=True)
+        os.makedirs(cache_path, exist_ok=True)
     except Exception as e:
-        print(f"❌ Failed to create temp download folder {temp_downloads_path}: {e}")
-        return False, image_name
-
-    # Paths for potential file locations
-    file_path = os.path.join(temp_downloads_path, image_name)
-    file_cache_path = os.path.join(cache_path, image_name)
+        print(f"❌ Failed to create cache folder {cache_path}: {e}")
+        return
 
-    # If it's already in cache, copy it to temp and skip actual download
-    if os.path.exists(file_cache_path):
+    # Locked so overlapping requests saving the same image, or updating the recorded size, don't count it twice
+    with _cache_lock:
+        # Write each image to cache_path, tracking how many bytes were added
+        added_size = 0
+        for image_name, image_bytes in downloads.items():
+            file_path = os.path.join(cache_path, image_name)
+            # Overlapping requests share coalesced downloads, skip images another request already cached
+            if os.path.exists(file_path):
+                continue
+            try:
+                # Rename into place in one step, so an interrupted write never leaves a truncated image that looks cached
+                write_file_atomically(file_path, image_bytes)
+                added_size += len(image_bytes)
+            except Exception as e:
+                print(f"❌ Failed to save image to cache folder {image_name}: {e}")
+
+        # Update the recorded cache size once for the whole batch, measure the folder if there's no usable record
+        cache_size = read_cache_size()
+        write_cache_size(get_folder_size(cache_path) if cache_size is None else cache_size + added_size)
+
+
+async def download_image_async(session, semaphore, image_name, image_type):
+    """
+    Download a single image by name into memory, at a resolution suited to image_type ("poster", "profile",
+    "backdrop", or "logo"). If it's already cached, skip the download. The semaphore caps how many downloads are in flight at once.
+    Returns a tuple (success: bool, image_name: str, image_bytes: bytes or None for cached images).
+    """
+    # If it's already in cache, skip actual download
+    if os.path.exists(os.path.join(cache_path, image_name)):
         print(f"ℹ️ Cached image available for {image_name}")
-        try:
-            shutil.copy(file_cache_path, file_path)
-            return True, image_name
-        except Exception as e:
-            print(f"❌ Failed to copy cached image {image_name}: {e}")
-            return False, image_name
+        return True, image_name, None
 
     # Choose appropriate resolution based on image_type
     res = "w500"
@@ -118,58 +261,119 @@ def download_image(image_name):
     # Construct the TMDB image URL
     url = f"https://image.tmdb.org/t/p/{res}/{image_name}"
 
-    try:
-        response = requests.get(url, stream=True, timeout=10)
-        # Raise an HTTPError if the response was unsuccessful (4xx or 5xx)
-        response.raise_for_status()
-
-        # Write the file in chunks to avoid high memory usage
-        with open(file_path, "wb") as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
-
-        print(f"✅ Downloaded: {image_name}")
-        return True, image_name
-
-    except requests.RequestException as e:
-        # Catch network-related errors (timeouts, connection errors, etc.)
-        print(f"❌ Download failed (network issue): {image_name} ({e})")
-    except Exception as e:
-        # Catch any other unexpected errors during file write
-        print(f"❌ Download failed: {image_name} ({e})")
-    return False, image_name
+    async with semaphore:
+        for attempt in range(max_retries + 1):
+            # Wait a little longer before each retry
+            if attempt:
+                await asyncio.sleep(retry_backoff_factor * (2 ** (attempt - 1)))
+
+            try:
+                async with session.get(url) as response:
+                    # Retry on transient server errors
+                    if response.status in retry_statuses and attempt < max_retries:
+                        continue
+
+                    # Raise a ClientResponseError if the response was unsuccessful (4xx or 5xx)
+                    response.raise_for_status()
+
+                    # Keep the image in memory, it's decoded from there and only written to the cache at the end
+                    image_bytes = await response.read()
+
+                print(f"✅ Downloaded: {image_name}")
+                return True, image_name, image_bytes
+
+            except aiohttp.ClientConnectionError as e:
+                # Retry on dropped or refused connections
+                if attempt < max_retries:
+                    continue
+                print(f"❌ Download failed (network issue): {image_name} ({e})")
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                # Catch other network-related errors (timeouts, HTTP errors, etc.)
+                print(f"❌ Download failed (network issue): {image_name} ({e})")
+            except Exception as e:
+                # Catch any other unexpected errors
+                print(f"❌ Download failed: {image_name} ({e})")
+            return False, image_name, None
+
+
+async def download_image_coalesced(session, semaphore, image_name, image_type):
+    """
+    Download an image with download_image_async, or wait for the same download if an overlapping request
+    already has it in flight instead of starting a second one.
+    """
+    key = (image_type, image_name)
+    task = _inflight_downloads.get(key)
+    if task is None:
+        task = asyncio.ensure_future(download_image_async(session, semaphore, image_name, image_type))
+        _inflight_downloads[key] = task
+        task.add_done_callback(lambda _: _inflight_downloads.pop(key, None))
+    # Shield the shared download, so one request being cancelled doesn't cancel it for the others
+    return await asyncio.shield(task)
 
 
-def download_images_concurrently(images):
+async def download_images_concurrently(images, image_type, max_concurrency=None, prepare=None, max_prepared=None):
     """
-    Download a list of image filenames in parallel using a ThreadPoolExecutor.
-    Returns a list of filenames that were successfully downloaded, preserving input order.
+    Download a list of image filenames of the given image_type concurrently on the event loop using the shared
+    aiohttp session, with at most max_concurrency (by default tuned per image_type) downloads in flight.
+    If prepare is given, each freshly downloaded image is passed to it (as a file-like object) in decode_pool
+    as soon as it arrives, until max_prepared images (unlimited if None) have been prepared.
+    Returns a tuple (list of filenames that were successfully downloaded or cached, preserving input order,
+    mapping {image: bytes} of the freshly downloaded ones, mapping {image: prepared image}).
     """
     successful_set = set()
+    downloads = {}
+    prepared_images = {}
+    # Images listed more than once are only downloaded and returned once
+    unique_images = list(dict.fromkeys(images))
     print(f"⏳ Downloading {len(images)} images...\n")
 
-    try:
-        with ThreadPoolExecutor(max_workers=10) as executor:
-            # Submit all download tasks
-            future_to_name = {executor.submit(download_image, fname): fname for fname in images}
+    if max_concurrency is None:
+        max_concurrency = download_concurrency.get(image_type, default_download_concurrency)
+
+    loop = asyncio.get_running_loop()
+    # Number of images being or already prepared, counted before preparing so concurrent downloads can't overshoot max_prepared
+    prepared_count = 0
+
+    async def download_and_prepare(session, semaphore, fname):
+        nonlocal prepared_count
+        result = await download_image_coalesced(session, semaphore, fname, image_type)
+        image_bytes = result[2]
+        if image_bytes is not None and prepare is not None and (max_prepared is None or prepared_count < max_prepared):
+            prepared_count += 1
+            try:
+                prepared = await loop.run_in_executor(decode_pool, prepare, BytesIO(image_bytes))
+                if prepared is not None:
+                    prepared_images[fname] = prepared
+            except Exception as e:
+                # Leave it to the encoding step to retry
+                print(f"❌ Failed to decode {fname}: {e}")
+        return result
 
-            # As each task completes, collect successes
-            for future in as_completed(future_to_name):
-                try:
-                    success, fname = future.result()
-                    if success:
-                        successful_set.add(fname)
-                except Exception as e:
-                    # If a thread raised an unexpected exception, log it
-                    print(f"❌ Unexpected error downloading {future_to_name[future]}: {e}")
+    try:
+        session = get_session()
+        semaphore = asyncio.Semaphore(max_concurrency)
+        # Wait for every download, collecting exceptions as results so one failing image doesn't cancel the others
+        results = await asyncio.gather(*(download_and_prepare(session, semaphore, fname) for fname in unique_images), return_exceptions=True)
+
+        # Collect successes
+        for fname, result in zip(unique_images, results):
+            if isinstance(result, BaseException):
+                # If a task raised an unexpected exception, log it
+                print(f"❌ Unexpected error downloading {fname}: {result!r}")
+                continue
+            success, fname, image_bytes = result
+            if success:
+                successful_set.add(fname)
+            if image_bytes is not None:
+                downloads[fname] = image_bytes
 
     except Exception as e:
         print(f"❌ Error setting up concurrent downloads: {e}")
 
-    # Preserve the original order of images for those that succeeded
-    ordered_successful_list = [fname for fname in images if fname in successful_set]
+    # Preserve the original order of images for those that succeeded, listing each image once
+    ordered_successful_list = [fname for fname in unique_images if fname in successful_set]
     print(f"\nℹ️ Downloaded {len(successful_set)} images out of {len(images)} requested\n")
-    return ordered_successful_list
+    return ordered_successful_list, downloads, prepared_images
 
 
 def group_duplicate_images(duplicates):
@@ -178,31 +382,45 @@ def group_duplicate_images(duplicates):
     Returns a list of groups (each group is a list of filenames), where multi-image groups
     come first, followed by singletons.
     """
-    adjacency = {}
-    # Build undirected adjacency list
+    # Assign each unique filename an integer id, in order of first appearance
+    id_of = {}
+    for img, duplicate_images in duplicates.items():
+        id_of.setdefault(img, len(id_of))
+        for other in duplicate_images:
+            id_of.setdefault(other, len(id_of))
+
+    # Union-find with path compression and union by rank
+    parent = list(range(len(id_of)))
+    rank = [0] * len(id_of)
+
+    def find(i):
+        root = i
+        while parent[root] != root:
+            root = parent[root]
+        # Point every node on the path directly at the root
+        while parent[i] != root:
+            parent[i], i = root, parent[i]
+        return root
+
+    def union(a, b):
+        root_a, root_b = find(a), find(b)
+        if root_a == root_b:
+            return
+        if rank[root_a] < rank[root_b]:
+            root_a, root_b = root_b, root_a
+        parent[root_b] = root_a
+        if rank[root_a] == rank[root_b]:
+            rank[root_a] += 1
+
     for img, duplicate_images in duplicates.items():
-        adjacency.setdefault(img, set())
         for other in duplicate_images:
-            adjacency.setdefault(other, set())
-            adjacency[img].add(other)
-            adjacency[other].add(img)
-
-    visited = set()
-    groups = []
-
-    def dfs(node, comp):
-        visited.add(node)
-        comp.append(node)
-        for nbr in adjacency.get(node, []):
-            if nbr not in visited:
-                dfs(nbr, comp)
-
-    # Find all connected components
-    for node in adjacency:
-        if node not in visited:
-            comp = []
-            dfs(node, comp)
-            groups.append(comp)
+            union(id_of[img], id_of[other])
+
+    # Bucket filenames by their root, groups keep the order of their first member
+    groups_by_root = {}
+    for name, i in id_of.items():
+        groups_by_root.setdefault(find(i), []).append(name)
+    groups = list(groups_by_root.values())
 
     # Separate multi-image groups from single-image groups
     multi = [grp for grp in groups if len(grp) > 1]
@@ -216,18 +434,15 @@ def sort_dict_based_on_list(dict_to_sort, reference_list):
     Given a dictionary and a reference order (list), produce a new dict containing only
     keys present in reference_list, in that same order.
     """
-    sorted_dict = OrderedDict()
-    for fname in reference_list:
-        if fname in dict_to_sort:
-            sorted_dict[fname] = dict_to_sort[fname]
-    return dict(sorted_dict)
+    # Regular dicts preserve insertion order
+    return {fname: dict_to_sort[fname] for fname in reference_list if fname in dict_to_sort}
 
 
 def flatten_list_group(nested_list):
     """
     Flatten a list of lists into a single list.
     """
-    return [image for sublist in nested_list for image in sublist]
+    return list(chain.from_iterable(nested_list))
 
 
 def extract_duplicates_from_groups(data):
@@ -235,20 +450,248 @@ def extract_duplicates_from_groups(data):
     From a list of groups (each a list of filenames), return a flat list of filenames
     that are in multi-image groups (i.e., actually have duplicates).
     """
-    return [item for group in data if len(group) > 1 for item in group]
+    return list(chain.from_iterable(group for group in data if len(group) > 1))
 
 
 # If the cache grows beyond 50 MB, clear it on module load
 try:
-    if get_folder_size(cache_path) > 50 * 1024 * 1024:
+    cache_size = read_cache_size()
+    # Without a usable size record, fall back to walking the cache folder
+    cache_over_limit = folder_size_exceeds(cache_path, cache_size_limit) if cache_size is None else cache_size > cache_size_limit
+    if cache_over_limit:
         shutil.rmtree(cache_path, ignore_errors=True)
 except Exception as e:
     print(f"❌ Error while clearing cache folder {cache_path}: {e}")
 
 
-def find_dups(min_similarity_threshold=0.85):
+class ReducedPrecisionModel(torch.nn.Module):
+    """
+    Run a model in a lower precision. Inputs are cast down to the model's dtype and features are cast back to float32.
+    """
+
+    def __init__(self, model, dtype):
+        super().__init__()
+        self.model = model.to(dtype)
+        self.dtype = dtype
+
+    def forward(self, x):
+        return self.model(x.to(self.dtype)).float()
+
+
+def build_cnn_encoder():
+    """
+    Build the CNN encoder, running MobileNet in the configured cnn_precision on the best available device.
+    """
+    if cnn_precision not in cnn_precision_dtypes:
+        cnn_encoder = CNN(verbose=False)
+    else:
+        model = ReducedPrecisionModel(MobilenetV3(), cnn_precision_dtypes[cnn_precision])
+        model_config = CustomModel(name=f"{MobilenetV3.name}_{cnn_precision}", model=model, transform=MobilenetV3.transform)
+        cnn_encoder = CNN(verbose=False, model_config=model_config)
+
+    # imagededup already uses an NVIDIA GPU when available, otherwise try Apple's Metal GPU before falling back to CPU
+    if cnn_encoder.device.type == "cpu" and torch.backends.mps.is_available():
+        cnn_encoder.device = torch.device("mps")
+        cnn_encoder.model.to(cnn_encoder.device)
+
+    print(f"ℹ️ CNN running on {cnn_encoder.device.type.upper()} ({cnn_precision})\n")
+    return cnn_encoder
+
+
+def get_encoder(method):
+    """
+    Return the cached encoder for a detection method ("phash" or "cnn"), building it on first use.
+    """
+    with _encoders_lock:
+        encoder = _encoders.get(method)
+        if encoder is None:
+            encoder = PHash(verbose=False) if method == "phash" else build_cnn_encoder()
+            _encoders[method] = encoder
+    return encoder
+
+
+def load_encodings(method):
+    """
+    Load the stored encodings for a detection method ("phash" or "cnn").
+    Returns a mapping {image: encoding}, empty if nothing is stored or the file is unreadable.
+    """
+    file_path = encoding_file_paths[method]
+    try:
+        if method == "phash":
+            with open(file_path, "r") as f:
+                return json.load(f)
+        with np.load(file_path) as data:
+            return dict(zip(data["names"].tolist(), data["encodings"]))
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        print(f"ℹ️ Ignoring unreadable encodings file {file_path}: {e}")
+    return {}
+
+
+def save_encodings(method, encodings):
+    """
+    Store the encodings for a detection method. PHash hashes go to JSON, CNN vectors to a compressed npz.
+    Callers must hold _cache_lock, so overlapping requests don't overwrite each other's encodings.
+    """
+    file_path = encoding_file_paths[method]
+    try:
+        os.makedirs(cache_path, exist_ok=True)
+        if method == "phash":
+            data = json.dumps(encodings).encode()
+        else:
+            buffer = BytesIO()
+            np.savez_compressed(buffer, names=np.array(list(encodings)), encodings=np.stack(list(encodings.values())))
+            data = buffer.getvalue()
+        write_file_atomically(file_path, data)
+    except Exception as e:
+        print(f"❌ Failed to save encodings file {file_path}: {e}")
+
+
+def encode_cnn_batches(cnn_encoder, images):
+    """
+    Encode images with the CNN, running cnn_batch_size images through the model per forward pass.
+    Takes an iterable of (image_name, preprocessed image tensor) pairs and returns a mapping {image: encoding}.
+    """
+    encodings = {}
+    batch_names, batch_tensors = [], []
+
+    def run_batch():
+        batch = torch.stack(batch_tensors)
+        if cnn_encoder.device.type == "cuda":
+            # Pinned memory lets the copy to the GPU run asynchronously
+            batch = batch.pin_memory()
+        features = cnn_encoder.model(batch.to(cnn_encoder.device, non_blocking=True)).cpu().numpy()
+        encodings.update(zip(batch_names, features))
+        batch_names.clear()
+        batch_tensors.clear()
+
+    with torch.inference_mode():
+        for image_name, image_tensor in images:
+            batch_names.append(image_name)
+            batch_tensors.append(image_tensor)
+            if len(batch_names) == cnn_batch_size:
+                run_batch()
+        if batch_names:
+            run_batch()
+    return encodings
+
+
+def get_image_file(image_name, downloads):
+    """
+    Return something load_image can read an image from: freshly downloaded images are read straight
+    from memory, cached ones from cache_path.
+    """
+    image_bytes = downloads.get(image_name)
+    return BytesIO(image_bytes) if image_bytes is not None else os.path.join(cache_path, image_name)
+
+
+def prepare_image(method, encoder, image_file):
     """
-    Identify duplicate images in temp_downloads_path using either Perceptual hashing (PHash) for logos
+    Decode an image (a path or file-like object) and prepare it for the encoder: the finished hash for PHash,
+    a preprocessed tensor for the CNN. Returns None if the image can't be read.
+    """
+    image_array = load_image(image_file, target_size=None, grayscale=False)
+    if image_array is None:
+        return None
+    if method == "phash":
+        return encoder.encode_image(image_array=image_array)
+    return encoder.apply_preprocess(image_array)
+
+
+def encode_images(method, encoder, image_names, downloads, prepared_images):
+    """
+    Encode the given images. Images already prepared while downloading are used as they are,
+    the rest are decoded and prepared here. Returns a mapping {image: encoding}, leaving out images that couldn't be read.
+    """
+
+    def prepare_images():
+        # Images not prepared while downloading are decoded lazily, only when their batch is reached,
+        # and prepared ones are dropped as they are consumed so their memory is freed batch by batch
+        for image_name in image_names:
+            prepared = prepared_images.pop(image_name, None)
+            if prepared is None:
+                try:
+                    prepared = prepare_image(method, encoder, get_image_file(image_name, downloads))
+                except Exception as e:
+                    print(f"❌ Failed to encode {image_name}: {e}")
+                    continue
+            if prepared is None:
+                print(f"❌ Failed to encode {image_name}: unreadable image")
+                continue
+            yield image_name, prepared
+
+    # PHash images are prepared all the way to their hash
+    if method == "phash":
+        return dict(prepare_images())
+
+    return encode_cnn_batches(encoder, prepare_images())
+
+
+def get_encodings(method, encoder, image_names, downloads, prepared_images):
+    """
+    Return encodings for the given images. Images encoded on earlier runs are read from the cache,
+    only new ones are encoded and then added to the stored encodings.
+    """
+    with _cache_lock:
+        stored_encodings = load_encodings(method)
+
+    new_image_names = [image_name for image_name in image_names if image_name not in stored_encodings]
+    print(f"ℹ️ Reusing {len(image_names) - len(new_image_names)} stored encodings, encoding {len(new_image_names)} images\n")
+    if new_image_names:
+        new_encodings = encode_images(method, encoder, new_image_names, downloads, prepared_images)
+        if new_encodings:
+            # Reload before merging, another request may have saved its encodings while these were being computed
+            with _cache_lock:
+                stored_encodings = load_encodings(method)
+                stored_encodings.update(new_encodings)
+                save_encodings(method, stored_encodings)
+
+    return {image_name: stored_encodings[image_name] for image_name in image_names if image_name in stored_encodings}
+
+
+def popcount64(values):
+    """
+    Count the set bits of each element in a uint64 array.
+    """
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(values)
+    return _popcount_table[values.view(np.uint8)].reshape(*values.shape, 8).sum(axis=-1, dtype=np.uint8)
+
+
+def find_phash_duplicates(encoding_map, max_distance_threshold):
+    """
+    Find duplicates among PHash hashes ({image: 16 character hex hash}) whose Hamming distance is at most
+    max_distance_threshold. Distances are computed with vectorized XOR and popcount over blocks of rows,
+    instead of imagededup's per-pair search. Returns a mapping {image: [list of duplicates]}.
+    """
+    image_names = list(encoding_map)
+    hashes = np.array([int(image_hash, 16) for image_hash in encoding_map.values()], dtype=np.uint64)
+
+    duplicates = {}
+    for start in range(0, len(hashes), phash_block_size):
+        block = hashes[start : start + phash_block_size]
+        distances = popcount64(block[:, None] ^ hashes[None, :])
+        for row, image_name in enumerate(image_names[start : start + len(block)]):
+            is_duplicate = distances[row] <= max_distance_threshold
+            # An image isn't a duplicate of itself
+            is_duplicate[start + row] = False
+            duplicates[image_name] = [image_names[i] for i in np.flatnonzero(is_duplicate)]
+    return duplicates
+
+
+def get_detection_method(image_type):
+    """
+    Return the duplicate detection method for an image_type: "phash" for logos, "cnn" for everything else.
+    """
+    use_phash_for = "logo"
+    return "phash" if image_type in use_phash_for else "cnn"
+
+
+def find_dups(image_names, image_type, downloads, prepared_images, min_similarity_threshold=0.85):
+    """
+    Identify duplicates among image_names (with freshly downloaded images passed in memory as downloads,
+    and those already prepared for the encoder as prepared_images) using either Perceptual hashing (PHash) for logos
     or Convolutional Neural Network (CNN) for other image types. Returns a mapping {image: [list of duplicates]}.
     """
     # Ensure threshold is a float
@@ -259,27 +702,29 @@ def find_dups(min_similarity_threshold=0.85):
         # Fallback to default
         min_similarity_threshold = 0.85
 
-    from imagededup.methods import CNN, PHash
-
-    use_phash_for = "logo"
-
-    if image_type in use_phash_for:
+    if get_detection_method(image_type) == "phash":
         # For logos, use PHash (binary hashes) and convert similarity threshold to Hamming distance
         try:
-            phasher = PHash(verbose=False)
+            phasher = get_encoder("phash")
+            encoding_map = get_encodings("phash", phasher, image_names, downloads, prepared_images)
+            if not encoding_map:
+                return {}
             # Convert similarity threshold to max Hamming distance (0 to 64)
             max_distance_threshold = int((1 - min_similarity_threshold) * 64)
             print(f"🤖 Identifying duplicates using PHash (max distance threshold: {max_distance_threshold}) / (mst: {min_similarity_threshold})...\n")
-            return phasher.find_duplicates(image_dir=temp_downloads_path, max_distance_threshold=max_distance_threshold)
+            return find_phash_duplicates(encoding_map, max_distance_threshold)
         except Exception as e:
             print(f"❌ Error in PHash duplicate detection: {e}")
             return {}
     else:
         # For all other image types, use CNN embeddings with cosine similarity
         try:
-            cnn_encoder = CNN(verbose=False)
+            cnn_encoder = get_encoder("cnn")
+            encoding_map = get_encodings("cnn", cnn_encoder, image_names, downloads, prepared_images)
+            if not encoding_map:
+                return {}
             print(f"🤖 Identifying duplicates using CNN (min similarity threshold: {min_similarity_threshold:.2f})...\n")
-            return cnn_encoder.find_duplicates(image_dir=temp_downloads_path, min_similarity_threshold=min_similarity_threshold)
+            return cnn_encoder.find_duplicates(encoding_map=encoding_map, min_similarity_threshold=min_similarity_threshold)
         except Exception as e:
             print(f"❌ Error in CNN duplicate detection: {e}")
             return {}
@@ -294,7 +739,6 @@ async def find_duplicate_images(data, websocket):
 
     # Safely extract expected fields from incoming data
     try:
-        global image_type
         image_type = data.get("imageType", "")
         images_list = data.get("images", [])
         min_similarity = data.get("minSimilarityThreshold", 0.85)
@@ -310,17 +754,29 @@ async def find_duplicate_images(data, websocket):
         Send a 'toast' notification (simple message) to the client over the WebSocket.
         """
         try:
-            await websocket.send(json.dumps({"action": "toast", "data": message}))
+            await websocket.send(orjson.dumps({"action": "toast", "data": message}), text=True)
         except Exception as e:
             print(f"❌ Failed to send toast message '{message}': {e}")
 
     # Notify client that downloads are starting
     await display_toast("📥 Fetching images...")
 
+    # Load the encoder up front, so downloaded images can be prepared for it while others are still downloading
+    prepare, max_prepared = None, None
+    try:
+        method = get_detection_method(image_type)
+        encoder = await asyncio.to_thread(get_encoder, method)
+        prepare = functools.partial(prepare_image, method, encoder)
+        # PHash images are prepared down to a short hash, only CNN inputs are large enough to need a bound
+        if method == "cnn":
+            max_prepared = max_prepared_cnn_images
+    except Exception as e:
+        print(f"❌ Failed to load encoder, images will be decoded after downloading: {e}")
+
     # Download all requested images concurrently
-    downloaded_images = []
+    downloaded_images, downloads, prepared_images = [], {}, {}
     try:
-        downloaded_images = download_images_concurrently(images_list)
+        downloaded_images, downloads, prepared_images = await download_images_concurrently(images_list, image_type, prepare=prepare, max_prepared=max_prepared)
     except Exception as e:
         print(f"❌ Error during image download: {e}")
         return
@@ -330,7 +786,7 @@ async def find_duplicate_images(data, websocket):
 
     # Run the duplicate-finding in a thread to avoid blocking the event loop
     try:
-        duplicates_map = await asyncio.to_thread(find_dups, min_similarity)
+        duplicates_map = await asyncio.to_thread(find_dups, downloaded_images, image_type, downloads, prepared_images, min_similarity)
     except Exception as e:
         print(f"❌ Error during duplicate detection: {e}")
         return
@@ -352,11 +808,12 @@ async def find_duplicate_images(data, websocket):
 
     # Send the result back to the client
     try:
-        await websocket.send(json.dumps(result_payload))
+        # orjson serializes straight to UTF-8 bytes, send them as a text frame since the client parses it as JSON
+        await websocket.send(orjson.dumps(result_payload), text=True)
     except Exception as e:
         print(f"❌ Failed to send duplicate images result: {e}")
 
-    # Move the downloaded files into the cache folder for future reuse
-    move_downloads_to_cache_folder()
+    # Write the downloaded images into the cache folder for future reuse
+    await asyncio.to_thread(save_downloads_to_cache, downloads)
 
     print(f"✅ {'No ' if len(duplicate_images) == 0 else ''}Duplicate images found, result sent to client\n")
@@ -1,8 +1,8 @@
 import asyncio
 import websockets
-import json
+import orjson
 
-from find_duplicate_images import find_duplicate_images
+from find_duplicate_images import find_duplicate_images, close_session
 
 
 def get_version():
@@ -32,7 +32,7 @@ async def handler(websocket):
         async for message in websocket:
             try:
                 # Try to parse the received message as JSON
-                json_data = json.loads(message)
+                json_data = orjson.loads(message)
                 action = json_data.get("action")
                 # Extract the 'data' field from the JSON payload
                 data = json_data.get("data")
@@ -50,11 +50,11 @@ async def handler(websocket):
                     print(f"❌ Error in {action}: {e}")
 
             # Handle non-JSON messages
-            except json.JSONDecodeError:
+            except orjson.JSONDecodeError:
                 try:
                     # On version_request request, send the server version as version_result message
                     if message == "version_request":
-                        await websocket.send(json.dumps({"action": "version_result", "data": get_version()}))
+                        await websocket.send(orjson.dumps({"action": "version_result", "data": get_version()}), text=True)
                     else:
                         print("❌ Received unexpected message:", message)
                 except Exception as e:
@@ -71,19 +71,21 @@ async def main():
     Start the WebSocket server on localhost:8765 and run it indefinitely.
     """
     try:
-        async with websockets.serve(handler, "localhost", 8765) as server:
+        # permessage-deflate shrinks the result payload, whose long image filenames repeat across its lists,
+        # and browsers decompress it transparently so the userscripts need no changes
+        async with websockets.serve(handler, "localhost", 8765, compression="deflate") as server:
             print("✅ Server running on ws://localhost:8765\n")
             await server.serve_forever()
     except Exception as e:
         print("❌ Failed to start WebSocket server:", e)
+    finally:
+        # Release pooled HTTP connections used for image downloads
+        await close_session()
 
 
 if __name__ == "__main__":
     print("⏳ Starting server...")
 
-    # Load imagededup before starting the server
-    from imagededup.methods import CNN, PHash
-
     # Handle gracefuL shutdown on keyboard interrupt or system exit
     try:
         asyncio.run(main())